@@ -42,12 +42,33 @@ Output:
  
 Requirements:
     - boto3
+    - pyahocorasick (optional, speeds up matching when there are many partial name filters)
     - AWS Resource Explorer View using aggregator index with all resources and tags
 """
-import boto3, csv, argparse, logging, sys, time
-from collections import defaultdict
+import boto3, csv, argparse, contextlib, functools, io, itertools, logging, os, sys
+from botocore.config import Config
+from collections import Counter, defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
  
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+ 
+# Number of partial name filters above which a single Aho-Corasick pass replaces per-filter substring scans
+PARTIAL_NAME_AUTOMATON_THRESHOLD = 50
+# Encoded tag plan rows are flushed to disk in chunks of this many bytes
+PLAN_BUFFER_SIZE = 1 << 20
+# Concurrent GetResources calls, each looking up tags for up to TAG_BATCH_SIZE ARNs
+TAG_WORKERS = 16
+TAG_BATCH_SIZE = 100
+# Resources are tagged and planned in chunks that give every tag worker one batch
+RESOURCE_CHUNK_SIZE = TAG_WORKERS * TAG_BATCH_SIZE
+ 
+# Tag key/value pair applied by a tag rule; the filter type is given by the bucket holding it
+Rule = namedtuple("Rule", "key value")
+ 
 def setup_logging(log_file):
     logging.basicConfig(
         filename=log_file,
@@ -55,11 +76,34 @@ def setup_logging(log_file):
         format="%(asctime)s - %(levelname)s - %(message)s",
     )
  
+@functools.lru_cache(maxsize=None)
+def _session():
+    # One session for every client: credentials (and any MFA prompt) are resolved once
+    # and service models are loaded once. Clients are only created on one thread at a time.
+    return boto3.Session()
+ 
+@functools.lru_cache(maxsize=None)
+def _client(service, region):
+    # One client per (service, region): avoids reloading the service model and shares the connection pool.
+    # Adaptive retries back off only on throttling responses, so calls are not paced by fixed sleeps.
+    return _session().client(
+        service,
+        region_name=region,
+        config=Config(
+            retries={"mode": "adaptive", "max_attempts": 10},
+            max_pool_connections=TAG_WORKERS,
+        ),
+    )
+ 
 def get_account_number(region="us-west-2"):
-    return boto3.client("sts", region_name=region).get_caller_identity()["Account"]
+    return _client("sts", region).get_caller_identity()["Account"]
  
 def load_tag_rules(path):
-    tag_map = defaultdict(list)
+    exact_keys = defaultdict(list)  # service, resource type, ARN or name -> rules
+    partial_names = defaultdict(list)  # name substring -> rules
+    tag_filters = defaultdict(list)  # (tag key, tag value, partial) -> rules
+    all_rules = []
+    rule_count = 0
     if not path.endswith(".csv"):
         logging.error(f"[ERROR] The CSV file '{path}' must end with '.csv'. Exiting.")
         print(f"The CSV file '{path}' must end with '.csv'. Exiting.")
@@ -69,27 +113,77 @@ def load_tag_rules(path):
         for row in reader:
             filter_value = row["Filter"].strip()
             if not filter_value or filter_value.startswith("#"):
-                logging.info(f"Skipping tag rule (starts with #): {row}")
                 continue
-            partial = False
+            # csv.DictReader gives None for missing trailing columns; csv.writer wrote ""
+            rule = Rule(row["TagKey"] or "", row["TagValue"] or "")
+            rule_count += 1
+            filter_value = filter_value.lower()
             if filter_value.startswith("~"):
-                partial = True
-                filter_value = filter_value[1:]
-            logging.info(f"Tag rule: {row}")
-            tag_map[filter_value.lower()].append(
-                {"Key": row["TagKey"], "Value": row["TagValue"], "Partial": partial}
-            )
-    return tag_map
+                partial_names[filter_value[1:]].append(rule)
+                continue
+            if filter_value == "all":
+                all_rules.append(rule)
+                continue
+            parts = filter_value.split(":", 2)
+            if parts[0] == "tag" and len(parts) == 3:
+                # tag:Key:Value or tag:Key:~Value (partial)
+                tag_key, tag_value = parts[1], parts[2]
+                partial = tag_value.startswith("~")
+                if partial:
+                    tag_value = tag_value[1:]
+                tag_filters[(tag_key, tag_value, partial)].append(rule)
+            else:
+                exact_keys[filter_value].append(rule)
+    logging.info(f"Loaded {rule_count} tag rules")
+    partial_names = tuple(
+        (substr, tuple(rules)) for substr, rules in partial_names.items()
+    )
+    partial_names_automaton = None
+    partial_names_always = frozenset()
+    if ahocorasick and len(partial_names) >= PARTIAL_NAME_AUTOMATON_THRESHOLD:
+        # Each substring maps to its index in partial_names. The automaton cannot hold
+        # an empty substring ("~"), which matches every name, so keep its index aside.
+        partial_names_automaton = ahocorasick.Automaton()
+        for idx, (substr, _) in enumerate(partial_names):
+            if substr:
+                partial_names_automaton.add_word(substr, idx)
+        partial_names_automaton.make_automaton()
+        partial_names_always = frozenset(
+            idx for idx, (substr, _) in enumerate(partial_names) if not substr
+        )
+    # Resource tags are only needed for Name and tag filters. Any exact filter other
+    # than an ARN may match a Name as well as a service or resource type.
+    needs_tags = bool(partial_names or tag_filters) or any(
+        not key.startswith("arn:") for key in exact_keys
+    )
+    # Services named by ARN filters (arn:partition:service:...), used to skip resources
+    # when every exact filter is an ARN. Filters too short to name a service never match.
+    services = {
+        parts[2]
+        for parts in (key.split(":", 3) for key in exact_keys if key.startswith("arn:"))
+        if len(parts) >= 3
+    }
+    return {
+        "exact_keys": {key: tuple(rules) for key, rules in exact_keys.items()},
+        "partial_names": partial_names,
+        "partial_names_automaton": partial_names_automaton,
+        "partial_names_always": partial_names_always,
+        "tag_filters": tuple(
+            (tag_key, tag_value, partial, tuple(rules))
+            for (tag_key, tag_value, partial), rules in tag_filters.items()
+        ),
+        "all_rules": tuple(all_rules),
+        "needs_tags": needs_tags,
+        "services": services,
+    }
  
 def get_view_arn(region, view_name):
-    client = boto3.client("resource-explorer-2", region_name=region)
-    paginator = client.get_paginator("list_views")
+    paginator = _client("resource-explorer-2", region).get_paginator("list_views")
     for page in paginator.paginate():
         for view in page.get("Views", []):
             # format: arn:aws:resource-explorer-2:region:account:view/view-name/uuid
-            view_parts = view.split(":")
-            full_view_name = view_parts[5]  # view/view-name/uuid
-            full_view_name_parts = full_view_name.split("/")
+            full_view_name = view.split(":", 5)[5]  # view/view-name/uuid
+            full_view_name_parts = full_view_name.rsplit("/", 2)
             if len(full_view_name_parts) >= 3:
                 rex_view_name = full_view_name_parts[-2]
                 if rex_view_name == view_name:
@@ -97,44 +191,18 @@ def get_view_arn(region, view_name):
     return None
  
 def get_all_resources(view_arn, region):
-    client = boto3.client("resource-explorer-2", region_name=region)
-    resources = []
-    next_token = None
-    while True:
-        params = {"ViewArn": view_arn, "MaxResults": 100}
-        if next_token:
-            params["NextToken"] = next_token
-        response = client.list_resources(**params)
-        page = response.get("Resources", [])
-        resources.extend(page)
-        next_token = response.get("NextToken")
-        if not next_token:
-            break
-        time.sleep(0.1)
-    return resources
- 
-def get_match_keys(service, subtype, arn, name):
-    keys = set()
-    if arn:
-        keys.add(arn)
-    if name:
-        keys.add(name)
-    if subtype:
-        subtype = subtype.lower()
-        if ":" in subtype:
-            keys.add(subtype)
-        else:
-            keys.add(f"{service.lower()}:{subtype}")
-    keys.add(service.lower())
-    return keys
- 
-def get_resource_name(tags):
-    for tag in tags:
-        if tag.get("Key") == "Name":
-            return tag.get("Value")
-    return None
+    paginator = _client("resource-explorer-2", region).get_paginator("list_resources")
+    # ListResources accepts up to 1000 results per page; throttling is handled by botocore retries.
+    # Filter by region server side; filters with the same prefix are ORed, so global resources are kept.
+    pages = paginator.paginate(
+        ViewArn=view_arn,
+        Filters={"FilterString": f"region:{region} region:global"},
+        PaginationConfig={"PageSize": 1000},
+    )
+    for page in pages:
+        yield from page.get("Resources", [])
  
-def get_tags_for_resources(resources):
+def get_tags_for_resources(resources, executor):
     # Group ARNs by region for API call
     arns_by_region = defaultdict(list)
     for res in resources:
@@ -142,99 +210,175 @@ def get_tags_for_resources(resources):
         region = res.get("Region") or "global"
         client_region = "us-east-1" if region == "global" else region
         arns_by_region[client_region].append(arn)
-    # Get tags in batches of 100
+    # Get tags in batches of 100, fetching batches concurrently on the shared executor
+    batches = [
+        (client_region, arn_list[i : i + TAG_BATCH_SIZE])
+        for client_region, arn_list in arns_by_region.items()
+        for i in range(0, len(arn_list), TAG_BATCH_SIZE)
+    ]
     tags_map = {}  # arn -> [ {Key, Value}, ... ]
-    for client_region, arn_list in arns_by_region.items():
-        client = boto3.client("resourcegroupstaggingapi", region_name=client_region)
-        for i in range(0, len(arn_list), 100):
-            batch = arn_list[i : i + 100]
-            try:
-                response = client.get_resources(ResourceARNList=batch)
-            except Exception as e:
-                logging.info(
-                    f"[INFO] Could not get tags for batch in {client_region}: {e}"
-                )
-                continue
-            for mapping in response.get("ResourceTagMappingList", []):
-                arn = mapping["ResourceARN"]
-                tags_map[arn] = mapping.get("Tags", [])
-            time.sleep(0.1)
+    futures = {
+        executor.submit(
+            _client("resourcegroupstaggingapi", client_region).get_resources,
+            ResourceARNList=batch,
+        ): client_region
+        for client_region, batch in batches
+    }
+    for future in as_completed(futures):
+        try:
+            response = future.result()
+        except Exception as e:
+            logging.info(
+                f"[INFO] Could not get tags for batch in {futures[future]}: {e}"
+            )
+            continue
+        for mapping in response.get("ResourceTagMappingList", []):
+            arn = mapping["ResourceARN"]
+            tags_map[arn] = mapping.get("Tags", [])
     # Attach tags to resources
     for res in resources:
         arn = res.get("Arn", "")
         res["Tags"] = tags_map.get(arn, [])
     return resources
  
-def write_plan(resources, tag_rules, output_csv, region_filter):
-    written = set()  # Track unique (ARN, TagKey, TagValue) rows
-    with open(output_csv, "w", newline="") as f:
-        writer = csv.writer(f)
-        writer.writerow(["ResourceARN", "TagKey", "TagValue"])
-        for res in resources:
-            arn = res.get("Arn")
-            service = res.get("Service")
-            subtype = res.get("ResourceType", "")
-            if not arn or not service:
-                continue
-            arn_parts = arn.split(":")
-            arn_region = arn_parts[3]
-            if arn_region and arn_region != region_filter:
-                logging.info(f"Skipping {arn} due to region mismatch {arn_region}")
+def get_next_chunk(resources, needs_tags, executor):
+    chunk = list(itertools.islice(resources, RESOURCE_CHUNK_SIZE))
+    if chunk and needs_tags:
+        chunk = get_tags_for_resources(chunk, executor)
+    return chunk
+ 
+def encode_csv_row(row):
+    line = ",".join(row)
+    if line.count(",") == len(row) - 1 and not any(c in line for c in '"\r\n'):
+        return line.encode() + b"\r\n"
+    # Fields with commas, quotes or newlines need the csv module's quoting
+    out = io.StringIO()
+    csv.writer(out).writerow(row)
+    return out.getvalue().encode()
+ 
+def write_plan_chunk(resources, tag_rules, f):
+    exact_keys = tag_rules["exact_keys"]
+    partial_names = tag_rules["partial_names"]
+    partial_names_automaton = tag_rules["partial_names_automaton"]
+    partial_names_always = tag_rules["partial_names_always"]
+    tag_filters = tag_rules["tag_filters"]
+    # "all" tags are the same for every matched resource
+    all_rules = tag_rules["all_rules"]
+    # When every filter is an ARN, only resources of a service named by one can match
+    services = None if tag_rules["needs_tags"] else tag_rules["services"]
+    # Per-row logging is only worth formatting when debug logging is on
+    log_rows = logging.getLogger().isEnabledFor(logging.DEBUG)
+    counts = Counter()  # rows written, resources skipped and resources without a match
+    buf = bytearray()
+    for res in resources:
+        arn = res.get("Arn")
+        service = res.get("Service")
+        subtype = res.get("ResourceType", "")
+        if not arn or not service:
+            counts["skipped"] += 1
+            continue
+        service_lower = service.lower()
+        if services is not None and service_lower not in services:
+            counts["skipped"] += 1
+            continue
+        # Lowercase once per resource; filters were lowercased by load_tag_rules.
+        # Tag key -> tag value, shared by the Name lookup and tag filters.
+        tag_dict = {
+            tag.get("Key", "").lower(): tag.get("Value", "").lower()
+            for tag in res.get("Tags", [])
+        }
+        name_lower = tag_dict.get("name")
+        arn_lower = arn.lower()
+        subtype_key = None
+        if subtype:
+            subtype_lower = subtype.lower()
+            subtype_key = (
+                subtype_lower
+                if ":" in subtype_lower
+                else f"{service_lower}:{subtype_lower}"
+            )
+        tags = []
+        # Exact matches on ARN, Name, resource type and service
+        for key in (arn_lower, name_lower, subtype_key, service_lower):
+            tags.extend(exact_keys.get(key, ()))
+        # Partial matches for Name
+        if name_lower:
+            if partial_names_automaton is not None:
+                matched = {idx for _, idx in partial_names_automaton.iter(name_lower)}
+                for idx in sorted(matched | partial_names_always):
+                    tags.extend(partial_names[idx][1])
+            else:
+                for substr, rules in partial_names:
+                    if substr in name_lower:
+                        tags.extend(rules)
+        # Tag key/value filter: tag:Key:Value or tag:Key:~Value (partial)
+        for tag_key, tag_value, partial, rule_list in tag_filters:
+            resource_tag_value = tag_dict.get(tag_key)
+            if resource_tag_value is None:
                 continue
-            name_value = get_resource_name(res.get("Tags", []))
-            match_keys = get_match_keys(service, subtype, arn, name_value)
-            tags = []
-            # Exact matches
-            for key in match_keys:
-                for rule in tag_rules.get(key, []):
-                    if not rule.get("Partial"):
-                        tags.append({"Key": rule["Key"], "Value": rule["Value"]})
-            # Partial matches for Name
-            if name_value:
-                for rule_key, rule_list in tag_rules.items():
-                    for rule in rule_list:
-                        if rule.get("Partial") and rule_key in name_value:
-                            tags.append({"Key": rule["Key"], "Value": rule["Value"]})
-            # Tag key/value filter: tag:Key:Value or tag:Key:~Value (partial)
-            for rule_key, rule_list in tag_rules.items():
-                if rule_key.startswith("tag:"):
-                    parts = rule_key.split(":", 2)
-                    if len(parts) == 3:
-                        tag_key, tag_value = parts[1], parts[2]
-                        tag_value_filter = tag_value
-                        partial = False
-                        if tag_value_filter.startswith("~"):
-                            partial = True
-                            tag_value_filter = tag_value_filter[1:]
-                        for tag in res.get("Tags", []):
-                            if tag.get("Key", "").lower() == tag_key.lower():
-                                resource_tag_value = tag.get("Value", "")
-                                if (
-                                    partial
-                                    and tag_value_filter.lower()
-                                    in resource_tag_value.lower()
-                                ) or (
-                                    not partial
-                                    and resource_tag_value.lower()
-                                    == tag_value_filter.lower()
-                                ):
-                                    for rule in rule_list:
-                                        tags.append(
-                                            {"Key": rule["Key"], "Value": rule["Value"]}
-                                        )
+            if (partial and tag_value in resource_tag_value) or (
+                not partial and resource_tag_value == tag_value
+            ):
+                tags.extend(rule_list)
+ 
+        if tags:
+            # Unique (ARN, TagKey, TagValue) rows for this resource, in rule order
+            rows = list(
+                dict.fromkeys(
+                    itertools.chain(
+                        ((arn, rule.key, rule.value) for rule in tags),
+                        ((arn, rule.key, rule.value) for rule in all_rules),
+                    )
+                )
+            )
+            for row in rows:
+                buf += encode_csv_row(row)
+            counts["written"] += len(rows)
+            if len(buf) >= PLAN_BUFFER_SIZE:
+                f.write(buf)
+                buf.clear()
+            if log_rows:
+                for row in rows:
+                    logging.debug(f"Wrote tag plan: {', '.join(row)}")
+        else:
+            counts["no_match"] += 1
+    f.write(buf)
+    return counts
  
-            if tags:
-                tags += tag_rules.get("all", [])
-                for tag in tags:
-                    row = (arn, tag["Key"], tag["Value"])
-                    if row not in written:
-                        writer.writerow(row)
-                        written.add(row)
+def write_plan(resources, tag_rules, plan_file):
+    # Stream resources in chunks so memory stays bounded by the chunk size. One
+    # background thread lists and tags the next chunk while this one is planned.
+    # Progress is logged once per chunk rather than per resource.
+    # The plan is written to a .partial file and only renamed to plan_file once
+    # complete, so a failed run never leaves a plan that looks valid.
+    needs_tags = tag_rules["needs_tags"]
+    partial_file = f"{plan_file}.partial"
+    processed = 0
+    counts = Counter()
+    try:
+        with ThreadPoolExecutor(max_workers=TAG_WORKERS) as executor:
+            with ThreadPoolExecutor(max_workers=1) as prefetch:
+                with open(partial_file, "wb") as f:
+                    f.write(encode_csv_row(("ResourceARN", "TagKey", "TagValue")))
+                    next_chunk = prefetch.submit(
+                        get_next_chunk, resources, needs_tags, executor
+                    )
+                    while chunk := next_chunk.result():
+                        next_chunk = prefetch.submit(
+                            get_next_chunk, resources, needs_tags, executor
+                        )
+                        counts += write_plan_chunk(chunk, tag_rules, f)
+                        processed += len(chunk)
                         logging.info(
-                            f"Wrote tag plan: {arn}, {tag['Key']}, {tag['Value']}"
+                            f"Progress: {processed} resources, "
+                            f"{counts['written']} rows written"
                         )
-            else:
-                logging.info(f"No matching tags for {arn} ({service})")
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(partial_file)
+        raise
+    os.replace(partial_file, plan_file)
+    return processed, counts
  
 def main():
     parser = argparse.ArgumentParser(
@@ -275,8 +419,16 @@ def main():
     print(f"Discovering resources using view: {view_arn}")
     logging.info(f"Discovering resources using view: {view_arn}")
     resources = get_all_resources(view_arn, args.region)
-    resources = get_tags_for_resources(resources)
-    write_plan(resources, tag_rules, plan_file, args.region)
+    needs_tags = tag_rules["needs_tags"]
+    if not needs_tags:
+        logging.info(
+            "Every tag rule is an ARN filter or 'all', skipping resource tag lookup"
+        )
+    processed, counts = write_plan(resources, tag_rules, plan_file)
+    logging.info(
+        f"Done: wrote {counts['written']} rows for {processed} resources, "
+        f"skipped {counts['skipped']}, no match {counts['no_match']}"
+    )
     print(f"Tag plan: {plan_file}")
     print(f"Log file: {log_file}")
     logging.info(f"Tag plan: {plan_file}")